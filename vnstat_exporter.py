@@ -4,13 +4,15 @@ VNStat Prometheus Exporter
 -------------------------
 
 This exporter collects network traffic statistics from vnstat and exports them in Prometheus format.
+vnstat is read when Prometheus scrapes the metrics endpoint.
 
 Usage:
-    python3 vnstat_exporter.py [--port PORT] [--interval INTERVAL]
+    python3 vnstat_exporter.py [--port PORT] [--interval INTERVAL] [--database PATH]
 
 Options:
     --port      Port to expose metrics on (default: 9469)
-    --interval  Update interval in seconds (default: 60)
+    --interval  Minimum seconds between vnstat reads (default: 60)
+    --database  Read the vnstat SQLite database directly instead of running vnstat
 
 Useful Commands:
     # Start the exporter
@@ -19,6 +21,9 @@ Useful Commands:
     # Start with custom port and interval
     python3 vnstat_exporter.py --port 8080 --interval 30
 
+    # Read the vnstat database directly (vnstat 2.x)
+    python3 vnstat_exporter.py --database /var/lib/vnstat/vnstat.db
+
     # Daemonize app on non-systemd systems
     python3 vnstat_exporter.py --daemoen
     # Check metrics endpoint
@@ -40,22 +45,26 @@ Useful Commands:
     journalctl -u vnstat_exporter | grep ERROR
 
 Metrics Exported:
-    vnstat_traffic_5min    - Traffic in the last 5 minutes
-    vnstat_traffic_hourly  - Hourly network traffic
-    vnstat_traffic_daily   - Daily network traffic
-    vnstat_traffic_monthly - Monthly network traffic
-    vnstat_traffic_yearly  - Yearly network traffic
-    vnstat_traffic_total   - Total network traffic
+    vnstat_traffic_bytes - Network traffic in bytes
 
 Labels:
     interface - Network interface name (e.g., eth0)
     direction - Traffic direction (rx for received, tx for transmitted)
+    period    - Period of the traffic: 5min (the last 5 minutes), hourly,
+                daily, monthly, yearly or total
 """
 
+import os
 import subprocess
-import json
-from prometheus_client import start_http_server, Gauge
+import sqlite3
+from contextlib import closing
+from urllib.parse import quote
+import orjson
+from prometheus_client import start_http_server, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
 import time
+import threading
+import signal
 import argparse
 import logging
 import logging.handlers
@@ -80,155 +89,205 @@ stream_handler.setFormatter(stream_formatter)
 # Add handlers to logger
 logger.addHandler(stream_handler)
 
-# Define all Prometheus metrics
-TRAFFIC_5MIN = Gauge('vnstat_traffic_5min', 'Traffic in the last 5 minutes', ['interface', 'direction'])
-TRAFFIC_HOURLY = Gauge('vnstat_traffic_hourly', 'Hourly network traffic', ['interface', 'direction'])
-TRAFFIC_DAILY = Gauge('vnstat_traffic_daily', 'Daily network traffic', ['interface', 'direction'])
-TRAFFIC_MONTHLY = Gauge('vnstat_traffic_monthly', 'Monthly network traffic', ['interface', 'direction'])
-TRAFFIC_YEARLY = Gauge('vnstat_traffic_yearly', 'Yearly network traffic', ['interface', 'direction'])
-TRAFFIC_TOTAL = Gauge('vnstat_traffic_total', 'Total network traffic', ['interface', 'direction'])
+# Define the Prometheus metric
+TRAFFIC = ('vnstat_traffic_bytes', 'Network traffic in bytes')
+LABELS = ['interface', 'direction', 'period']
+
+# Period label values and the vnstat JSON key holding their entries
+PERIODS = [
+    ('5min', 'fiveminute'),
+    ('hourly', 'hour'),
+    ('daily', 'day'),
+    ('monthly', 'month'),
+    ('yearly', 'year'),
+]
 
 def get_vnstat_data(interface=None):
     """Get network traffic data from vnstat in JSON format"""
-    cmd = ['vnstat', '--json']
+    # Only the latest entry of each period is used, let vnstat skip the rest
+    cmd = ['vnstat', '--json', 'a', '1']
     if interface:
         cmd.extend(['-i', interface])
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return json.loads(result.stdout)
+        result = subprocess.run(cmd, capture_output=True, check=True)
+        return orjson.loads(result.stdout)
     except subprocess.CalledProcessError as e:
-        logger.ERROR(f"Error running vnstat: {e}")
+        logger.error("Error running vnstat: %s", e)
+        return None
+    except orjson.JSONDecodeError as e:
+        logger.error("Error parsing vnstat output: %s", e)
         return None
-    except json.JSONDecodeError as e:
-        logger.ERROR(f"Error parsing vnstat output: {e}")
+
+# Latest entry of a period table for every interface in the vnstat database
+DB_PERIOD_QUERY = """
+    SELECT interface.name, entry.rx, entry.tx
+    FROM interface
+    JOIN {table} AS entry ON entry.id = (
+        SELECT id FROM {table} WHERE interface = interface.id
+        ORDER BY date DESC LIMIT 1)
+"""
+
+def get_vnstat_db_data(database):
+    """Get network traffic data straight from the vnstat SQLite database
+
+    Returns the same structure as get_vnstat_data(), holding only the
+    latest entry of each period.
+    """
+    try:
+        # Connect per call, vnstat may replace the database file underneath us
+        with closing(sqlite3.connect(f"file:{quote(database)}?mode=ro", uri=True)) as db:
+            interfaces = {}
+            for name, rx, tx in db.execute("SELECT name, rxtotal, txtotal FROM interface"):
+                interfaces[name] = {'name': name, 'traffic': {'total': {'rx': rx, 'tx': tx}}}
+            for _, key in PERIODS:
+                for name, rx, tx in db.execute(DB_PERIOD_QUERY.format(table=key)):
+                    interfaces[name]['traffic'][key] = [{'rx': rx, 'tx': tx}]
+    except sqlite3.Error as e:
+        logger.error("Error reading vnstat database %s: %s", database, e)
         return None
+    return {'interfaces': list(interfaces.values())}
 
-def update_metrics():
-    """Update Prometheus metrics with current vnstat data"""
-    data = get_vnstat_data()
-    if not data:
-        return
+def traffic_metrics(data):
+    """Build the Prometheus metrics from vnstat data"""
+    metric = GaugeMetricFamily(*TRAFFIC, labels=LABELS)
 
     for interface in data.get('interfaces', []):
         iface_name = interface.get('name')
         traffic = interface.get('traffic', {})
 
-        # Process 5 minute data - get the latest entry
-        fiveminute = traffic.get('fiveminute', [])
-        if fiveminute:
-            latest_5min = fiveminute[-1]  # Get the most recent entry
-            TRAFFIC_5MIN.labels(
-                interface=iface_name,
-                direction='rx'
-            ).set(latest_5min.get('rx', 0))
-            TRAFFIC_5MIN.labels(
-                interface=iface_name,
-                direction='tx'
-            ).set(latest_5min.get('tx', 0))
-
-        # Process hour data - get the latest entry
-        hours = traffic.get('hour', [])
-        if hours:
-            latest_hour = hours[-1]
-            TRAFFIC_HOURLY.labels(
-                interface=iface_name,
-                direction='rx'
-            ).set(latest_hour.get('rx', 0))
-            TRAFFIC_HOURLY.labels(
-                interface=iface_name,
-                direction='tx'
-            ).set(latest_hour.get('tx', 0))
-
-        # Process daily data - get the latest entry
-        days = traffic.get('day', [])
-        if days:
-            latest_day = days[-1]
-            TRAFFIC_DAILY.labels(
-                interface=iface_name,
-                direction='rx'
-            ).set(latest_day.get('rx', 0))
-            TRAFFIC_DAILY.labels(
-                interface=iface_name,
-                direction='tx'
-            ).set(latest_day.get('tx', 0))
-
-        # Process monthly data
-        months = traffic.get('month', [])
-        if months:
-            latest_month = months[-1]
-            TRAFFIC_MONTHLY.labels(
-                interface=iface_name,
-                direction='rx'
-            ).set(latest_month.get('rx', 0))
-            TRAFFIC_MONTHLY.labels(
-                interface=iface_name,
-                direction='tx'
-            ).set(latest_month.get('tx', 0))
-
-        # Process yearly data
-        years = traffic.get('year', [])
-        if years:
-            latest_year = years[-1]
-            TRAFFIC_YEARLY.labels(
-                interface=iface_name,
-                direction='rx'
-            ).set(latest_year.get('rx', 0))
-            TRAFFIC_YEARLY.labels(
-                interface=iface_name,
-                direction='tx'
-            ).set(latest_year.get('tx', 0))
+        # Process periodic data - get the latest entry of each period
+        for period, key in PERIODS:
+            entries = traffic.get(key)
+            if entries:
+                latest_get = entries[-1].get
+                metric.add_metric([iface_name, 'rx', period], latest_get('rx', 0))
+                metric.add_metric([iface_name, 'tx', period], latest_get('tx', 0))
 
         # Process total data
-        total = traffic.get('total', {})
-        TRAFFIC_TOTAL.labels(
-            interface=iface_name,
-            direction='rx'
-        ).set(total.get('rx', 0))
-        TRAFFIC_TOTAL.labels(
-            interface=iface_name,
-            direction='tx'
-        ).set(total.get('tx', 0))
+        total_get = traffic.get('total', {}).get
+        metric.add_metric([iface_name, 'rx', 'total'], total_get('rx', 0))
+        metric.add_metric([iface_name, 'tx', 'total'], total_get('tx', 0))
+
+    return [metric]
+
+def get_database_mtime(database):
+    """Get the modification time of the vnstat database, None if unknown"""
+    try:
+        mtime = os.stat(database).st_mtime_ns
+    except OSError:
+        return None
+    # With DatabaseWriteAheadLogging enabled vnstat writes to the -wal file
+    try:
+        return max(mtime, os.stat(database + '-wal').st_mtime_ns)
+    except OSError:
+        return mtime
+
+def stdout_is_journal():
+    """Check whether systemd connected our stdout to the journal"""
+    # JOURNAL_STREAM is inherited by children, it only applies when its
+    # <dev>:<ino> matches our own stdout
+    try:
+        dev, ino = os.environ['JOURNAL_STREAM'].split(':')
+        stat = os.fstat(sys.stdout.fileno())
+        return stat.st_dev == int(dev) and stat.st_ino == int(ino)
+    except (KeyError, ValueError, OSError, AttributeError):
+        return False
 
 class vnstat_metrics:
-    def __init__(self):
+    """Prometheus collector reading vnstat when scraped"""
+
+    def __init__(self, port, interval, database=None):
+        self.port = port
+        self.interval = interval
+        self.database = database
+        self.lock = threading.Lock()
+        self.data = {}
+        self.database_mtime = None
+        self.updated = None
+
         # Start up the server to expose the metrics
         try:
-            start_http_server(args.port)
-            logger.info(f"Metrics server started on port {args.port}")
+            REGISTRY.register(self)
+            start_http_server(self.port)
+            logger.info("Metrics server started on port %d", self.port)
         except Exception as e:
-            logger.error(f"Failed to start metrics server: {e}")
+            logger.error("Failed to start metrics server: %s", e)
             sys.exit(1)
 
-    def run(self):
-        # Update metrics periodically
-        while True:
+    def refresh(self):
+        """Read vnstat again unless the current data is still valid"""
+        now = time.monotonic()
+        if self.updated is not None and now - self.updated < self.interval:
+            return
+        self.updated = now
+
+        # vnstat only writes its database every few minutes, the data
+        # read before stays valid until it does. Only known for --database,
+        # vnstat itself may be configured with another DatabaseDir.
+        mtime = None
+        if self.database:
+            mtime = get_database_mtime(self.database)
+            if mtime is not None and mtime == self.database_mtime:
+                return
+
+        logger.debug("Processing vnstat data...")
+        if self.database:
+            data = get_vnstat_db_data(self.database)
+        else:
+            data = get_vnstat_data()
+        if data:
+            self.data = data
+            self.database_mtime = mtime
+
+    def describe(self):
+        # Keep registration from calling vnstat
+        return traffic_metrics({})
+
+    def collect(self):
+        with self.lock:
             try:
-                logger.info("Processing vnstat data...")
-                update_metrics()
+                self.refresh()
             except Exception as e:
-                logger.error(f"Error updating metrics: {e}")
-            time.sleep(args.interval)
+                logger.error("Error updating metrics: %s", e)
+            data = self.data
+        return traffic_metrics(data)
+
+    def run(self):
+        # Metrics are collected when scraped, just keep the server running
+        while True:
+            signal.pause()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='VNStat Prometheus Exporter')
     parser.add_argument('--port', type=int, default=9469,
                       help='Port to expose metrics on (default: 9469)')
     parser.add_argument('--interval', type=int, default=60,
-                      help='Metrics update interval in seconds (default: 60)')
+                      help='Minimum seconds between vnstat reads (default: 60)')
     parser.add_argument('--daemon', action='store_true',
                         help='Daemonize app on non-systemd systems')
+    parser.add_argument('--database', metavar='PATH',
+                        help='Read the vnstat SQLite database directly instead of running vnstat')
     args = parser.parse_args()
 
-    logger.info(f"Starting VNStat exporter on port {args.port}")
-    logger.info(f"Update interval: {args.interval} seconds")
+    if stdout_is_journal() and not args.daemon:
+        # systemd already sends stdout to the journal, skip the syslog copy
+        logger.removeHandler(syslog_handler)
+        syslog_handler.close()
+
+    logger.info("Starting VNStat exporter on port %d", args.port)
+    logger.info("Minimum read interval: %d seconds", args.interval)
     
     # Test vnstat access
     logger.info("Testing vnstat access...")
-    if get_vnstat_data():
-        logger.info("Successfully called vnstat")
+    if args.database:
+        data = get_vnstat_db_data(args.database)
+    else:
+        data = get_vnstat_data()
+    if data:
+        logger.info("Successfully read vnstat data")
     else:
-        logger.error("Failed to call vnstat")
+        logger.error("Failed to read vnstat data")
         sys.exit(1)
 
 
@@ -239,6 +298,6 @@ if __name__ == '__main__':
         logger.removeHandler(stream_handler)
 
         with daemon.DaemonContext():
-            vnstat_metrics().run()
+            vnstat_metrics(args.port, args.interval, args.database).run()
     else:
-        vnstat_metrics().run()
+        vnstat_metrics(args.port, args.interval, args.database).run()